@@ -1,18 +1,71 @@
-import select
+import functools
+import os
+import queue
+import re
+import selectors
 import socket
 import threading
 import time
 import tkinter as tk
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import scrolledtext, messagebox
 
+try:
+    import fcntl
+except ImportError:     # Not available on Windows
+    fcntl = None
+
+# Header patterns, matched against the header section of a message only
+_HOST_RE = re.compile(rb'^Host:[ \t]*([^:\r\n]*)', re.IGNORECASE | re.MULTILINE)
+_LAST_MODIFIED_RE = re.compile(rb'^Last-Modified:[ \t]*([^\r\n]*)', re.IGNORECASE | re.MULTILINE)
+_STATUS_RE = re.compile(rb'HTTP/\d\.\d[ \t]+(\d{3})')
+_CONTENT_LENGTH_RE = re.compile(rb'^Content-Length:[ \t]*(\d+)', re.IGNORECASE | re.MULTILINE)
+_CHUNKED_RE = re.compile(rb'^Transfer-Encoding:[^\r\n]*chunked', re.IGNORECASE | re.MULTILINE)
+_CONNECTION_CLOSE_RE = re.compile(rb'^Connection:[^\r\n]*close', re.IGNORECASE | re.MULTILINE)
+_EXPECT_CONTINUE_RE = re.compile(rb'^Expect:[ \t]*100-continue', re.IGNORECASE | re.MULTILINE)
+_HOP_BY_HOP_RE = re.compile(rb'^(?:Connection|Proxy-Connection|Keep-Alive):[^\r\n]*\r\n', re.IGNORECASE | re.MULTILINE)
+_CONDITIONAL_RE = re.compile(rb'^If-(?:Modified-Since|None-Match):[^\r\n]*\r\n', re.IGNORECASE | re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=1)
+def _fmt_time(seconds: int) -> bytes:
+    """
+    Formats a time as an HTTP date. The last result is cached, so calls within the same second reuse it.
+
+    Parameters:
+    - seconds (int): The time in whole seconds since the epoch.
+
+    Returns:
+    - bytes: The HTTP date.
+    """
+    return time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(seconds)).encode()
+
 
 class WebProxyServer:
     # Constants
-    BACKLOG = 10        # Maximum number of pending connections
-    BUFFER = 8192       # Buffer size for data transfer
+    BACKLOG = 128       # Maximum number of pending connections
+    MAX_WORKERS = 32    # Maximum number of threads handling HTTP requests
+    BUFFER = 65536      # Buffer size for data transfer
     HTTP_PORT = 80      # Default HTTP port
     HTTPS_PORT = 443    # Default HTTPS port
+    SOCKET_BUFFER = 1 << 20     # Kernel send/receive buffer size for proxy sockets
+    SPLICE_SIZE = 1 << 20       # Maximum bytes moved by a single splice() call
+    CACHE_ENTRIES = 1024        # Maximum number of cached responses
+    CACHE_BYTES = 256 << 20     # Maximum total size of cached responses
+    PENDING_TIMEOUT = 30        # Seconds to wait for another thread fetching the same URL
+    SENDFILE_THRESHOLD = 1 << 20    # Cached responses at least this large are kept in a memfd and sent with sendfile()
+    DNS_ENTRIES = 1024          # Maximum number of cached host addresses
+    DNS_TTL = 60                # Seconds a resolved host address is reused
+    POOL_SIZE = 8               # Maximum number of idle connections kept per target server
+    POOL_TOTAL = 64             # Maximum number of idle connections kept across all target servers
+    POOL_IDLE_TIMEOUT = 5       # Seconds an idle connection is kept before it is closed
+    TIMEOUT = 30                # Seconds a blocking socket operation may take
+    REQUEST_TIMEOUT = 30        # Seconds a client may send nothing before its request is complete
+    MAX_HEADER_SIZE = 65536     # Maximum size of the headers of a client request
+    MAX_BODY_SIZE = 32 << 20    # Maximum size of the body of a client request
+    SWEEP_INTERVAL = 1          # Seconds between checks for expired connections
 
     def __init__(self, host='127.0.0.1', port=4000, callback=None):
         """
@@ -25,9 +78,24 @@ class WebProxyServer:
         """
         self.host = host
         self.port = port
-        self.cache = {}             # Cached responses
-        self.blocked_urls = set()   # Blocked URLs
+        self.cache = LRUCache(self.CACHE_ENTRIES, self.CACHE_BYTES)    # Cached responses
+        self.blocked_urls = frozenset()     # Blocked URLs, replaced as a whole so requests can check it without locking
+        self._blocked_lock = threading.Lock()
         self.callback = callback    # Callback function for logging
+
+        self.selector = selectors.DefaultSelector()             # Multiplexes the server socket and HTTPS tunnels
+        self._workers = ThreadPoolExecutor(self.MAX_WORKERS)    # Handles HTTP requests
+        self._tunnels = queue.SimpleQueue()                     # Tunnels waiting to join the selector
+        self._wakeup_r, self._wakeup_w = socket.socketpair()    # Interrupts the selector when a tunnel is queued
+        self._pending = {}                                      # URLs being fetched, mapped to their completion event
+        self._pending_lock = threading.Lock()
+        self._dns_cache = LRUCache(self.DNS_ENTRIES, self.DNS_ENTRIES)  # Host -> (address, expiry), each of size 1
+        self._pool = {}                                         # (host, port) -> [(idle socket, idle since)], oldest first
+        self._pool_idle = 0                                     # Number of idle sockets across the pool
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()                         # Per-thread receive buffer
+        self._requests = {}                                     # Client socket -> PendingRequest while reading its request
+        self._paused_listener = None                            # Proxy server socket while accepting is paused
     
     def _update_cb(self, message: str):
         """
@@ -41,219 +109,874 @@ class WebProxyServer:
         else:
             print(message)
     
+    def add_blocked_url(self, url: str) -> bool:
+        """
+        Adds a URL to the blocked list.
+
+        Parameters:
+        - url (str): The URL to block.
+
+        Returns:
+        - bool: False if the URL was already blocked.
+        """
+        with self._blocked_lock:
+            if url in self.blocked_urls:
+                return False
+            self.blocked_urls = self.blocked_urls | {url}
+        return True
+
+    def remove_blocked_url(self, url: str):
+        """
+        Removes a URL from the blocked list.
+
+        Parameters:
+        - url (str): The URL to unblock.
+        """
+        with self._blocked_lock:
+            self.blocked_urls = self.blocked_urls - {url}
+
+    def _mk_sock(self) -> socket.socket:
+        """
+        Creates a TCP socket with the proxy's socket options and timeout.
+
+        Returns:
+        - socket.socket: The new socket.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(self.TIMEOUT)
+        self._tune_socket(sock)
+        return sock
+
+    def _tune_socket(self, sock: socket.socket):
+        """
+        Disables Nagle's algorithm, enables keep-alive probes, and enlarges the kernel buffers of a socket.
+
+        Parameters:
+        - sock (socket.socket): The socket to configure.
+        """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.SOCKET_BUFFER)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SOCKET_BUFFER)
+
     def start(self):
         """
         Starts the web proxy server, by binding the server socket, and listening for incoming client connections.
-        When a new connection is accepted, a new thread is created to handle the client request.
+        A single selector loop accepts connections, reads their requests, and relays every HTTPS tunnel, while
+        complete requests are handed to a pool of worker threads.
         """
-        # Setup proxy server socket
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Setup proxy server socket, rebinding the port straight away after a restart
+        server_socket = self._mk_sock()
+        if os.name != 'nt':     # On Windows this would let another process bind the same port
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_socket.bind((self.host, self.port))
         server_socket.listen(self.BACKLOG)
+        server_socket.setblocking(False)
+
+        self.selector.register(server_socket, selectors.EVENT_READ, self._accept)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, self._register_tunnels)
 
         self._update_cb(f'Proxy Server Started: ({self.host}, {self.port})')
         self._update_cb(f'Backlog set to {self.BACKLOG}!')
 
+        select = self.selector.select
+        last_sweep = time.monotonic()
+        while True:
+            for key, mask in select(self.SWEEP_INTERVAL):
+                try:
+                    key.data(key.fileobj, mask)
+                except Exception as e:
+                    # Every tunnel runs on this loop, so one failing callback must not stop it
+                    self._update_cb(f'Error in selector loop: {e}')
+
+            now = time.monotonic()
+            if now - last_sweep >= self.SWEEP_INTERVAL:
+                if self._paused_listener is not None:
+                    self.selector.register(self._paused_listener, selectors.EVENT_READ, self._accept)
+                    self._paused_listener = None
+                self._expire_requests(now)
+                with self._pool_lock:
+                    self._expire_idle(now)
+                last_sweep = now
+
+    def _accept(self, server_socket: socket.socket, mask: int):
+        """
+        Accepts every pending client connection and starts reading its request.
+
+        Parameters:
+        - server_socket (socket.socket): The listening proxy server socket.
+        - mask (int): The selector events that are ready.
+        """
         while True:
-            # Accept connection
-            client_socket, client_address = server_socket.accept()
+            try:
+                client_socket, client_address = server_socket.accept()
+            except BlockingIOError:
+                return
+            except ConnectionAbortedError:
+                continue    # The client hung up while waiting to be accepted
+            except OSError as e:
+                # Out of file descriptors: stop accepting until the next sweep rather than spin on the ready listener
+                self._update_cb(f'Error accepting connection: {e}')
+                self.selector.unregister(server_socket)
+                self._paused_listener = server_socket
+                return
+            self._tune_socket(client_socket)
+            client_socket.setblocking(False)
+
             self._update_cb(f'Accepted Connection: {client_address}')
-            # Start a new thread to handle the client request
-            threading.Thread(target=self.handle_request, args=(client_socket, client_address)).start()
+            self._requests[client_socket] = PendingRequest(client_address)
+            self.selector.register(client_socket, selectors.EVENT_READ, self._read_request)
+
+    def _read_request(self, client_socket: socket.socket, mask: int):
+        """
+        Receives the next part of a client's request, and queues it on the worker pool once it is complete,
+        so idle or slow clients never hold a worker thread.
 
-    def handle_request(self, client_socket: socket.socket, client_address):
+        Parameters:
+        - client_socket (socket.socket): The socket used to communicate with the client.
+        - mask (int): The selector events that are ready.
+        """
+        request = self._requests[client_socket]
+        data = request.data
+        try:
+            received = self._recv_more(client_socket, data)
+        except BlockingIOError:
+            return
+        except OSError:
+            received = False
+
+        if not received:
+            self._drop_request(client_socket)
+            return
+        request.last_active = time.monotonic()
+
+        # The whole request is held in memory, so refuse any that are too large
+        header_end = data.find(b'\r\n\r\n')
+        if (header_end if header_end >= 0 else len(data)) > self.MAX_HEADER_SIZE:
+            self._reject_request(client_socket, b'431 Request Header Fields Too Large')
+            return
+        if header_end < 0:
+            return
+
+        body_start = header_end + 4
+        match = _CONTENT_LENGTH_RE.search(data, 0, body_start)
+        if max(int(match.group(1)) if match else 0, len(data) - body_start) > self.MAX_BODY_SIZE:
+            self._reject_request(client_socket, b'413 Content Too Large')
+            return
+
+        try:
+            end, request.resume = self._request_end(data, request.resume)
+        except ValueError:
+            self._reject_request(client_socket, b'400 Bad Request')
+            return
+
+        if end < 0:
+            # The client holds back the body until it is told to continue
+            if (not request.continued and _EXPECT_CONTINUE_RE.search(data, 0, body_start)
+                    and not data[:data.find(b'\r\n')].endswith(b'HTTP/1.0')):
+                request.continued = True
+                try:
+                    client_socket.send(b'HTTP/1.1 100 Continue\r\n\r\n')
+                except OSError:
+                    pass    # The next read sees the closed connection
+            return
+
+        self.selector.unregister(client_socket)
+        del self._requests[client_socket]
+        client_socket.settimeout(self.TIMEOUT)
+        self._workers.submit(self._handle_client, client_socket, request.address, bytes(data))
+
+    def _reject_request(self, client_socket: socket.socket, status: bytes):
+        """
+        Answers a client request that will not be handled with an error status, and closes the connection.
+
+        Parameters:
+        - client_socket (socket.socket): The socket used to communicate with the client.
+        - status (bytes): The status code and reason phrase of the response.
+        """
+        try:
+            client_socket.send(b'HTTP/1.1 ' + status + b'\r\nConnection: close\r\nContent-Length: 0\r\n\r\n')
+        except OSError:
+            pass    # The client has already gone
+        self._update_cb(f'Rejected Request: {self._requests[client_socket].address} ({status.decode()})\n')
+        self._drop_request(client_socket)
+
+    def _drop_request(self, client_socket: socket.socket):
+        """
+        Closes a client connection whose request is still being read.
+
+        Parameters:
+        - client_socket (socket.socket): The socket used to communicate with the client.
+        """
+        self.selector.unregister(client_socket)
+        del self._requests[client_socket]
+        client_socket.close()
+
+    def _expire_requests(self, now: float):
+        """
+        Closes client connections that have sent nothing for REQUEST_TIMEOUT seconds before completing their request.
+        A slow upload is kept as long as data keeps arriving.
+
+        Parameters:
+        - now (float): The current time.monotonic() value.
+        """
+        for client_socket, request in list(self._requests.items()):
+            if now - request.last_active > self.REQUEST_TIMEOUT:
+                self._update_cb(f'Timed Out: {request.address}\n')
+                self._drop_request(client_socket)
+
+    def _handle_client(self, client_socket: socket.socket, client_address, data: bytes):
+        """
+        Runs handle_request on a worker thread, logging errors that the pool would otherwise discard.
+
+        Parameters:
+        - client_socket (socket.socket): The socket used to communicate with the client.
+        - client_address: The IP and port of the client.
+        - data (bytes): The complete request received from the client.
+        """
+        try:
+            self.handle_request(client_socket, client_address, data)
+        except socket.timeout:
+            self._update_cb(f'Timed Out: {client_address}\n')
+            client_socket.close()
+        except Exception as e:
+            self._update_cb(f'Error handling {client_address}: {e}')
+            client_socket.close()
+
+    def _register_tunnels(self, wakeup_socket: socket.socket, mask: int):
+        """
+        Registers the queued HTTPS tunnels with the selector.
+
+        Parameters:
+        - wakeup_socket (socket.socket): The socket used to interrupt the selector.
+        - mask (int): The selector events that are ready.
+        """
+        wakeup_socket.recv(self.BUFFER)
+        while True:
+            try:
+                tunnel = self._tunnels.get_nowait()
+            except queue.Empty:
+                return
+            tunnel.start()
+
+    def handle_request(self, client_socket: socket.socket, client_address, data: bytes):
         """
         Handles an incoming client request, processes it, and sends an appropriate response.
         
         Parameters:
         - client_socket (socket.socket): The socket used to communicate with the client.
         - client_address: The IP and port of the client.
+        - data (bytes): The complete request received from the client.
         """
         # Start timer
         start_time = time.time()
 
-        # Receive request
-        request = client_socket.recv(self.BUFFER).decode()
-        self._update_cb(f'Client Request:\n{request}')
+        # Only the headers are decoded, and only for the log
+        self._update_cb(f'Client Request:\n{data[:self._header_end(data)].decode(errors="replace")}\n')
 
-        if not request:
-            client_socket.close()
+        # HTTPS only needs the host and port from the request line, so skip the parsing and cache below
+        if data.startswith(b'CONNECT '):
+            target = data[8:data.find(b'\r\n')].split(b' ', 1)[0]
+            if target.decode(errors='replace') in self.blocked_urls:
+                # Establish Connection with HTTPS, then send blocked response
+                client_socket.send(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+                self.send_forbidden(client_socket)
+                self._update_cb(f'Closed Connection: {client_address}\n')
+                client_socket.close()
+            else:
+                # The tunnel closes the connection when either side hangs up
+                early_data = data[self._header_end(data) + 4:]
+                self.handle_https(client_socket, client_address, target, early_data)
             return
         
-        # Extract URL and Host from request
-        target_url = self.get_url(request)
-        target_host = self.get_host(request)
+        # Extract URL and Host from request, decoding just these fields
+        method, target, host = self._parse_request(data)
+        target_url = target.decode(errors='replace')
+        target_host = host.decode(errors='replace')
+
+        # Only a GET without a body can share a response with other requests for the same URL,
+        # so other methods (e.g. HEAD, whose response has no body) neither read nor replace cache entries
+        cacheable = method == b'GET' and len(data) == self._header_end(data) + 4
+        entry = self.cache.get(target_url) if cacheable else None
 
         # If the target URL is blocked, respond with a 403 Forbidden message
         if target_url in self.blocked_urls:
-            # Establish Connection with HTTPS
-            if 'CONNECT' in request:
-                client_socket.send(b'HTTP/1.1 200 Connection Established\r\n\r\n')
-            
-            # Send blocked response
-            response = b'HTTP/1.1 403 Forbidden\r\n'
-            response += b'Content-Type: text/html\r\n\r\n'
-            response += b'<html><head><title>403 Forbidden</title></head><body><h1>403 Forbidden</h1><p>This page has been blocked by the proxy server.</p></body></html>'
-
-            client_socket.sendall(response)
+            self.send_forbidden(client_socket)
         # If the target URL is in the cache, serve the cached response
-        elif target_url in self.cache:
-            # Conditional GET request
-            conditional_request = 'GET ' + target_url + ' HTTP/1.1\r\n'
-            conditional_request += 'Host: ' + target_host + '\r\n'
-            conditional_request += 'If-Modified-Since: ' + self.cache[target_url][1].decode() + '\r\n\r\n'
-
-            conditional_response = self.forward_to_server(conditional_request, True)
+        elif entry is not None:
+            # Forward the request conditional on the cached response, so a changed page arrives in the same round trip
+            conditional_request = self.make_conditional(data, entry.last_modified)
+            conditional_response = self.forward_to_server(conditional_request, target_host)
 
-            # If the status code is 304 Not Modified, use the cached response, else forward the original request and cache the new response
+            # If the status code is 304 Not Modified, use the cached response, else forward and cache the new response
             if self.get_status_code(conditional_response) == b'304':
                 # Cached response
-                response = self.cache[target_url][0]
-                client_socket.sendall(response)
+                response = entry.body
+                self.send_cached(client_socket, response)
 
                 # Calculate time saved by caching the response
                 end_time = time.time()
                 execution_time = end_time - start_time
-                time_saved = self.cache[target_url][2] - execution_time
+                time_saved = entry.execution_time - execution_time
                 self._update_cb(f'Saved {time_saved} by Caching!')
             else:
                 # HTTP
-                response = self.forward_to_server(request)
-                client_socket.sendall(response.encode())
-
-                # Calculate time spent by forwarding the response
-                end_time = time.time()
-                execution_time = end_time - start_time
-                last_modified = self.get_last_modified(response)
-
-                # Cache response, last modified, and execution time
-                self.cache[target_url] = [response, last_modified, execution_time]
-        else:
+                client_socket.sendall(conditional_response)
+                self.cache_response(target_url, conditional_response, start_time)
+        elif cacheable:
             # Forward the response
-            if 'CONNECT' in request:
-                # HTTPS
-                self.handle_https(client_socket, request)
-            else:
-                # HTTP
-                response = self.forward_to_server(request)
-                client_socket.sendall(response)
-
-                # Calculate time spent by forwarding the response
-                end_time = time.time()
-                execution_time = end_time - start_time
-                last_modified = self.get_last_modified(response)
-
-                # Cache response, last modified, and execution time
-                self.cache[target_url] = [response, last_modified, execution_time]  
+            response = self.fetch(target_url, data, target_host, start_time)
+            self.send_cached(client_socket, response)
+        else:
+            # Forward the response without caching it
+            response = self.forward_to_server(data, target_host)
+            client_socket.sendall(response)
         
         # Close Connection
         self._update_cb(f'Closed Connection: {client_address}\n')
         client_socket.close()
 
-    def handle_https(self, client_socket: socket.socket, request: str):
+    def send_forbidden(self, client_socket: socket.socket):
+        """
+        Sends a 403 Forbidden response for a blocked URL.
+
+        Parameters:
+        - client_socket (socket.socket): The socket to communicate with the client.
+        """
+        response = b'HTTP/1.1 403 Forbidden\r\n'
+        response += b'Content-Type: text/html\r\n\r\n'
+        response += b'<html><head><title>403 Forbidden</title></head><body><h1>403 Forbidden</h1><p>This page has been blocked by the proxy server.</p></body></html>'
+
+        client_socket.sendall(response)
+
+    def handle_https(self, client_socket: socket.socket, client_address, target: bytes, early_data=b''):
         """
         Handles an HTTPS request by establishing a connection with the target server.
 
         Parameters:
         - client_socket (socket.socket): The socket to communicate with the client.
-        - request (str): The HTTPS request from the client.
+        - client_address: The IP and port of the client.
+        - target (bytes): The host and optional port from the CONNECT request line.
+        - early_data (bytes): Data the client sent after the CONNECT headers, e.g. the start of a TLS handshake.
         """
-        # Extract host from request
-        target_host = self.get_host(request)
-    
+        # Extract host and port from target
+        host, _, port = target.partition(b':')
+        target_host = host.decode(errors='replace')
+        target_port = int(port) if port else self.HTTPS_PORT
+
         # Setup the target server socket
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.connect((target_host, self.HTTPS_PORT))
-        
-        client_socket.send(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+        server_socket = self._mk_sock()
+        try:
+            server_socket.connect((self.resolve(target_host), target_port))
+            if early_data:
+                server_socket.sendall(early_data)
+            
+            client_socket.send(b'HTTP/1.1 200 Connection Established\r\n\r\n')
 
-        # Relay data between the client and the server
-        self.relay_https(client_socket, server_socket)
+            # Relay data between the client and the server
+            self.relay_https(client_socket, server_socket, client_address)
+        except Exception:
+            # The client socket is closed by the caller
+            server_socket.close()
+            raise
 
-    def relay_https(self, client_socket: socket.socket, server_socket: socket.socket):
+    def relay_https(self, client_socket: socket.socket, server_socket: socket.socket, client_address):
         """
-        Relays data between the client and server for HTTPS communication.
+        Hands an HTTPS connection over to the selector loop, which relays data between the client and server.
+        On Linux the data is moved with splice() so it never leaves the kernel.
 
         Parameters:
         - client_socket (socket.socket): The socket to communicate with the client.
         - server_socket (socket.socket): The socket to communicate with the target server.
+        - client_address: The IP and port of the client.
         """
-        while True:
-            rlist, _, _ = select.select([client_socket, server_socket], [], [])
-            for s in rlist:
-                data = s.recv(self.BUFFER)
+        if hasattr(os, 'splice'):
+            make_channel = lambda src, dst: SpliceChannel(src, dst, self.SPLICE_SIZE)
+        else:
+            make_channel = lambda src, dst: CopyChannel(src, dst, self.BUFFER)
 
-                if not data:
-                    client_socket.close()
-                    server_socket.close()
-                    return
+        on_close = lambda: self._update_cb(f'Closed Connection: {client_address}\n')
+        tunnel = Tunnel(self.selector, client_socket, server_socket, make_channel, on_close)
+
+        self._tunnels.put(tunnel)
+        self._wakeup_w.send(b'\0')
+
+    def fetch(self, target_url: str, request: bytes, target_host: str, start_time: float):
+        """
+        Forwards a request to the target server and caches the response.
+        Concurrent requests for the same URL wait for the first one and reuse its response.
+
+        Parameters:
+        - target_url (str): The URL being requested.
+        - request (bytes): The HTTP request to be sent to the server.
+        - target_host (str): The host the request is sent to.
+        - start_time (float): The time the client request was received.
+
+        Returns:
+        - bytes | io.FileIO: The server's response, as accepted by send_cached.
+        """
+        with self._pending_lock:
+            event = self._pending.get(target_url)
+            if event is None:
+                self._pending[target_url] = threading.Event()
+
+        # Another thread is already fetching this URL
+        if event is not None:
+            event.wait(self.PENDING_TIMEOUT)
+            entry = self.cache.get(target_url)
+            if entry is not None:
+                return entry.body
+            return self.forward_to_server(request, target_host)
+
+        try:
+            response = self.forward_to_server(request, target_host)
+            self.cache_response(target_url, response, start_time)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(target_url).set()
+
+        return response
+
+    def cache_response(self, target_url: str, response: bytes, start_time: float):
+        """
+        Caches a response from the target server.
+
+        Parameters:
+        - target_url (str): The URL that was requested.
+        - response (bytes): The server's response.
+        - start_time (float): The time the client request was received.
+        """
+        # Calculate time spent by forwarding the response
+        end_time = time.time()
+        execution_time = end_time - start_time
+        last_modified = self.get_last_modified(response)
 
-                if s is client_socket:
-                    server_socket.send(data)
-                else:
-                    client_socket.send(data)
+        # Cache response, last modified, and execution time
+        body = self.store_cached(response)
+        self.cache.put(target_url, CacheEntry(body, last_modified, execution_time), len(response))
 
-    def forward_to_server(self, request: str, conditional_get=False) -> bytes:
+    def make_conditional(self, request: bytes, last_modified: bytes) -> bytes:
+        """
+        Makes a request conditional on the cached response, replacing any conditions set by the client.
+
+        Parameters:
+        - request (bytes): The HTTP request.
+        - last_modified (bytes): The 'Last-Modified' value of the cached response.
+
+        Returns:
+        - bytes: The request with an 'If-Modified-Since' header.
+        """
+        line_end = request.find(b'\r\n') + 2
+        header_end = self._header_end(request) + 2
+        headers = _CONDITIONAL_RE.sub(b'', request[line_end:header_end])
+
+        return b''.join([
+            request[:line_end],
+            b'If-Modified-Since: ', last_modified, b'\r\n',
+            headers,
+            request[header_end:],
+        ])
+
+    def make_persistent(self, request: bytes) -> bytes:
+        """
+        Asks the target server to keep the connection open, so it can return to the pool. The client's own
+        Connection headers only apply to its connection with the proxy, so they are replaced.
+
+        Parameters:
+        - request (bytes): The HTTP request.
+
+        Returns:
+        - bytes: The request with a 'Connection: keep-alive' header.
+        """
+        line_end = request.find(b'\r\n') + 2
+        header_end = self._header_end(request) + 2
+        headers = _HOP_BY_HOP_RE.sub(b'', request[line_end:header_end])
+
+        return b''.join([
+            request[:line_end],
+            b'Connection: keep-alive\r\n',
+            headers,
+            request[header_end:],
+        ])
+
+    def store_cached(self, response: bytes):
+        """
+        Prepares a response for the cache. On Linux, large responses are moved into an anonymous
+        in-memory file so cache hits can be sent with sendfile() without copying through user space.
+        The file is closed once the last reference to it is dropped.
+
+        Parameters:
+        - response (bytes): The server's response.
+
+        Returns:
+        - bytes | io.FileIO: The response, or an in-memory file containing it.
+        """
+        if not hasattr(os, 'memfd_create') or len(response) < self.SENDFILE_THRESHOLD:
+            return response
+
+        body = open(os.memfd_create('cache'), 'r+b', buffering=0)
+        view = memoryview(response)
+        while view:
+            view = view[body.write(view):]
+        return body
+
+    def send_cached(self, client_socket: socket.socket, body):
+        """
+        Sends a response prepared by store_cached to the client.
+
+        Parameters:
+        - client_socket (socket.socket): The socket to communicate with the client.
+        - body (bytes | io.FileIO): The response to send.
+        """
+        if isinstance(body, bytes):
+            client_socket.sendall(body)
+        else:
+            client_socket.sendfile(body, 0)
+
+    def forward_to_server(self, request: bytes, target_host: str) -> bytes:
         """
         Forwards a request to the target server and returns the response.
         
         Parameters:
-        - request (str): The HTTP request to be sent to the server.
-        - conditional_get (bool): If true, only receive self.BUFFER bytes to avoid infinite looping
+        - request (bytes): The HTTP request to be sent to the server.
+        - target_host (str): The host the request is sent to.
         
         Returns:
         - bytes: The server's response.
         """
-        # Extract target host
-        target_host = self.get_host(request)
-        
-        # Setup target server socket
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.connect((target_host, self.HTTP_PORT))
-        server_socket.sendall(request.encode())
-
-        # If conditional_get, then only receive self.BUFFER bytes
-        if conditional_get:
-            server_response = server_socket.recv(self.BUFFER)
+        # Reuse an idle target server socket if there is one, and keep this one open for the next request
+        server_socket, pooled = self.connect(target_host, self.HTTP_PORT)
+        request = self.make_persistent(request)
+
+        try:
+            server_socket.sendall(request)
+            server_response, reusable = self.recv_all(server_socket, request.startswith(b'HEAD '))
+        except (BrokenPipeError, ConnectionResetError):
+            server_socket.close()
+            if not pooled:
+                raise
+            server_response, reusable = b'', False
+        except Exception:
+            # Timeouts and malformed responses leave the connection in an unknown state
+            server_socket.close()
+            raise
+
+        # The server closed the idle connection, so retry
+        if not server_response and pooled:
+            server_socket.close()
+            return self.forward_to_server(request, target_host)
+
+        if reusable:
+            self.release(target_host, self.HTTP_PORT, server_socket)
         else:
-            server_response = self.recv_all(server_socket)
-        
-        server_socket.close()
+            server_socket.close()
         return server_response
 
-    def recv_all(self, sock: socket.socket) -> bytes:
+    def connect(self, host: str, port: int) -> tuple:
+        """
+        Returns an idle connection to the target server from the pool, or opens a new one.
+
+        Parameters:
+        - host (str): The target host.
+        - port (int): The target port.
+
+        Returns:
+        - socket.socket: The connected target server socket.
+        - bool: True if the socket was taken from the pool.
+        """
+        with self._pool_lock:
+            self._expire_idle(time.monotonic())
+            idle = self._pool.get((host, port))
+            if idle:
+                server_socket, _ = idle.pop()
+                self._pool_idle -= 1
+                if not idle:
+                    del self._pool[(host, port)]
+                return server_socket, True
+
+        server_socket = self._mk_sock()
+        server_socket.connect((self.resolve(host), port))
+        return server_socket, False
+
+    def release(self, host: str, port: int, server_socket: socket.socket):
         """
-        Receives all data from a socket.
+        Returns a connection to the pool, or closes it if the pool for the target server or the whole pool is full.
+
+        Parameters:
+        - host (str): The target host.
+        - port (int): The target port.
+        - server_socket (socket.socket): The idle target server socket.
+        """
+        now = time.monotonic()
+        with self._pool_lock:
+            self._expire_idle(now)
+            idle = self._pool.setdefault((host, port), [])
+            if len(idle) < self.POOL_SIZE and self._pool_idle < self.POOL_TOTAL:
+                idle.append((server_socket, now))
+                self._pool_idle += 1
+                return
+            if not idle:
+                del self._pool[(host, port)]
+
+        server_socket.close()
+
+    def _expire_idle(self, now: float):
+        """
+        Closes pooled connections that have been idle for more than POOL_IDLE_TIMEOUT seconds,
+        before the target server closes them. Must be called with the pool lock held.
+
+        Parameters:
+        - now (float): The current time.monotonic() value.
+        """
+        deadline = now - self.POOL_IDLE_TIMEOUT
+        for key, idle in list(self._pool.items()):
+            while idle and idle[0][1] < deadline:
+                idle.pop(0)[0].close()
+                self._pool_idle -= 1
+            if not idle:
+                del self._pool[key]
+
+    def resolve(self, host: str) -> str:
+        """
+        Resolves a host to an IPv4 address, reusing the result for DNS_TTL seconds.
+
+        Parameters:
+        - host (str): The host to resolve.
+
+        Returns:
+        - str: The IPv4 address of the host.
+        """
+        now = time.monotonic()
+        cached = self._dns_cache.get(host)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        address = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+        self._dns_cache.put(host, (address, now + self.DNS_TTL), 1)
+        return address
+
+    def _request_end(self, data: bytearray, resume=0) -> tuple:
+        """
+        Finds the end of an HTTP request, including a body of Content-Length bytes or in chunks.
+
+        Parameters:
+        - data (bytearray): The request received so far.
+        - resume (int): The offset returned by the previous call for the same request, so chunks are only walked once.
+
+        Returns:
+        - int: The offset just past the end of the request, or -1 if it has not all been received.
+        - int: The offset to resume from once more of the request has been received.
+        """
+        header_end = data.find(b'\r\n\r\n')
+        if header_end < 0:
+            return -1, 0
+
+        body_start = header_end + 4
+        if _CHUNKED_RE.search(data, 0, body_start):
+            return self._chunked_end(data, max(resume, body_start))
+
+        match = _CONTENT_LENGTH_RE.search(data, 0, body_start)
+        end = body_start + int(match.group(1)) if match else body_start
+        if len(data) < end:
+            return -1, 0
+        return end, 0
+
+    def recv_all(self, sock: socket.socket, no_body=False) -> tuple:
+        """
+        Receives a complete HTTP response from a socket. The end of the body is found from its
+        Content-Length or chunked encoding, otherwise the response is read until the server closes the connection.
 
         Parameters:
         - sock (socket.socket): The socket to receive data from.
+        - no_body (bool): If true, the response has no body (e.g. the reply to a HEAD request).
 
         Returns:
-        - bytes: All data received from the socket.
+        - bytes: The response.
+        - bool: True if the whole response was read and the connection can be reused.
         """
-        data = b''
+        data = bytearray()
         while True:
-            chunk = sock.recv(self.BUFFER)
-            if not chunk:
+            body_start = self._recv_headers(sock, data)
+            if body_start < 0:
+                return bytes(data), False
+
+            headers = bytes(data[:body_start])
+            status = self.get_status_code(headers)
+            # Interim responses (e.g. 100 Continue) are followed by the final one
+            if not status.startswith(b'1') or status == b'101':
                 break
-            data += chunk
-        return data
+            del data[:body_start]
+
+        # After 101 Switching Protocols the connection no longer speaks HTTP
+        keep_alive = (headers.startswith(b'HTTP/1.1') and status != b'101'
+                      and not _CONNECTION_CLOSE_RE.search(headers))
+
+        if no_body or status in (b'101', b'204', b'304'):
+            end = body_start
+        elif _CHUNKED_RE.search(headers):
+            end = self._recv_chunked(sock, data, body_start)
+            if end is None:
+                return bytes(data), False
+        else:
+            match = _CONTENT_LENGTH_RE.search(headers)
+            if not match:
+                # The body ends when the server closes the connection
+                while self._recv_more(sock, data):
+                    pass
+                return bytes(data), False
+
+            end = body_start + int(match.group(1))
+            if len(data) < end:
+                # Receive the rest of the body straight into a buffer of its final size
+                received = len(data)
+                body = bytearray(end)
+                body[:received] = data
+                view = memoryview(body)
+                recv_into = sock.recv_into
+                while received < end:
+                    n = recv_into(view[received:])
+                    if not n:
+                        return bytes(view[:received]), False
+                    received += n
+                data = body
+
+        # Anything past the end of the response means the connection is out of step
+        return bytes(memoryview(data)[:end]), keep_alive and len(data) == end
+
+    def _recv_headers(self, sock: socket.socket, data: bytearray) -> int:
+        """
+        Receives data until the blank line ending the headers of an HTTP message.
+
+        Parameters:
+        - sock (socket.socket): The socket to receive data from.
+        - data (bytearray): The buffer the data is appended to.
+
+        Returns:
+        - int: The offset of the body, or -1 if the connection closed first.
+        """
+        # Data left over from an earlier message may already hold the headers
+        header_end = data.find(b'\r\n\r\n')
+        while header_end < 0:
+            # Only search the new data, and the end of the old data in case the blank line is split
+            start = max(len(data) - 3, 0)
+            if not self._recv_more(sock, data):
+                return -1
+            header_end = data.find(b'\r\n\r\n', start)
+        return header_end + 4
+
+    def _recv_chunked(self, sock: socket.socket, data: bytearray, pos: int):
+        """
+        Receives a chunked body into data, decoding the chunk sizes to find where it ends.
+
+        Parameters:
+        - sock (socket.socket): The socket to receive data from.
+        - data (bytearray): The response received so far.
+        - pos (int): The offset of the first chunk.
+
+        Returns:
+        - int: The offset just past the end of the body, or None if the connection closed first.
+        """
+        end, pos = self._chunked_end(data, pos)
+        while end < 0:
+            if not self._recv_more(sock, data):
+                return None
+            end, pos = self._chunked_end(data, pos)
+        return end
+
+    def _chunked_end(self, data: bytearray, pos: int) -> tuple:
+        """
+        Walks the chunks of a chunked body received so far to find where it ends.
+        A malformed chunk size raises ValueError.
+
+        Parameters:
+        - data (bytearray): The message received so far.
+        - pos (int): The offset of the first chunk not yet walked.
+
+        Returns:
+        - int: The offset just past the end of the body, or -1 if it has not all been received.
+        - int: The offset of the first incomplete chunk, to resume from once more data has been received.
+        """
+        while True:
+            line_end = data.find(b'\r\n', pos)
+            if line_end < 0:
+                return -1, pos
+
+            size = int(data[pos:line_end].split(b';', 1)[0], 16)
+            if size < 0:
+                raise ValueError(f'negative chunk size: {size}')
+            if not size:
+                break
+
+            # Skip the chunk data and its trailing CRLF
+            chunk_end = line_end + 2 + size + 2
+            if len(data) < chunk_end:
+                return -1, pos
+            pos = chunk_end
+
+        # The last chunk is followed by optional trailer fields and a blank line
+        end = data.find(b'\r\n\r\n', line_end)
+        if end < 0:
+            return -1, pos
+        return end + 4, pos
+
+    def _recv_more(self, sock: socket.socket, data: bytearray) -> bool:
+        """
+        Receives the next chunk of data from a socket.
+
+        Parameters:
+        - sock (socket.socket): The socket to receive data from.
+        - data (bytearray): The buffer the data is appended to.
+
+        Returns:
+        - bool: False if the connection has been closed.
+        """
+        view = getattr(self._local, 'view', None)
+        if view is None:
+            view = self._local.view = memoryview(bytearray(self.BUFFER))
+
+        n = sock.recv_into(view)
+        data += view[:n]
+        return n > 0
     
-    def get_url(self, request: str) -> str:
+    def _parse_request(self, request: bytes) -> tuple:
         """
-        Extracts the target URL from the HTTP request.
+        Extracts the method, target URL, and host from the HTTP request in a single pass.
 
         Parameters:
-        - request (str): The HTTP request.
+        - request (bytes): The HTTP request.
 
         Returns:
-        - str: The extracted target URL.
+        - tuple: The method, target URL, and host (without port) as bytes.
         """
-        lines = request.split('\r\n')
-        if lines:
-            return lines[0].split()[1]
-        return ''
+        end = request.find(b'\r\n')
+        if end < 0:
+            end = len(request)
+
+        request_line = request[:end].split()
+        method = request_line[0] if request_line else b''
+        target = request_line[1] if len(request_line) > 1 else b''
+
+        # Search the headers up to the blank line for Host
+        match = _HOST_RE.search(request, end, self._header_end(request))
+        host = match.group(1).strip() if match else b'localhost'
+
+        return method, target, host
     
+    def _header_end(self, message: bytes) -> int:
+        """
+        Finds the end of the header section of an HTTP message.
+
+        Parameters:
+        - message (bytes): The HTTP request or response.
+
+        Returns:
+        - int: The offset of the blank line ending the headers, or the message length if there is none.
+        """
+        end = message.find(b'\r\n\r\n')
+        if end < 0:
+            return len(message)
+        return end
+
     def get_status_code(self, response: bytes) -> bytes:
         """
         Extracts the status code from the HTTP response.
@@ -264,52 +987,341 @@ class WebProxyServer:
         Returns:
         - bytes: The extracted status code.
         """
-        lines = response.split(b'\r\n')
-        if lines:
-            return lines[0].split()[1]
+        match = _STATUS_RE.match(response)
+        if match:
+            return match.group(1)
         return b''
 
-    def get_host(self, request: str) -> str:
+    def get_last_modified(self, request: bytes) -> bytes:
         """
-        Extracts the host (and port) from the HTTP request.
+        Extracts the 'Last-Modified' header from the HTTP response.
 
         Parameters:
-        - request (str): The HTTP request.
+        - request (bytes): The HTTP response.
 
         Returns:
-        - str: The target host.
-        - int: The target port.
+        - bytes: The 'Last-Modified' header value or the current time.
         """
-        lines = request.split('\r\n')
-        for line in lines:
-            if line.lower().startswith('host:'):
-                host_line = line.split(':', 1)[1].strip()
+        match = _LAST_MODIFIED_RE.search(request, 0, self._header_end(request))
+        if match:
+            return match.group(1).strip()
+        return _fmt_time(int(time.time()))
 
-                if ':' in host_line:
-                    host, port = host_line.split(':', 1)
-                    return host.strip()
-                else:
-                    return host_line
-        return 'localhost'
 
-    def get_last_modified(self, request: bytes) -> bytes:
+class CacheEntry:
+    __slots__ = ('body', 'last_modified', 'execution_time')
+
+    def __init__(self, body, last_modified: bytes, execution_time: float):
         """
-        Extracts the 'Last-Modified' header from the HTTP response.
+        A cached response.
 
         Parameters:
-        - request (bytes): The HTTP response.
+        - body (bytes | io.FileIO): The response, as returned by WebProxyServer.store_cached.
+        - last_modified (bytes): The 'Last-Modified' header value of the response.
+        - execution_time (float): The time taken to fetch the response from the target server.
+        """
+        self.body = body
+        self.last_modified = last_modified
+        self.execution_time = execution_time
+
+
+class PendingRequest:
+    __slots__ = ('address', 'data', 'last_active', 'resume', 'continued')
+
+    def __init__(self, address):
+        """
+        A client request that the selector loop is still receiving.
+
+        Parameters:
+        - address: The IP and port of the client.
+        """
+        self.address = address
+        self.data = bytearray()
+        self.last_active = time.monotonic()     # When data last arrived from the client
+        self.resume = 0             # Where to resume walking a chunked body, as returned by _request_end
+        self.continued = False      # Whether a 100 Continue response has been sent
+
+
+class LRUCache:
+    def __init__(self, max_entries: int, max_bytes: int):
+        """
+        A thread-safe least recently used cache, bounded by number of entries and total size.
+
+        Parameters:
+        - max_entries (int): The maximum number of entries.
+        - max_bytes (int): The maximum total size of the entries.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0                   # Total size of the entries
+        self.entries = OrderedDict()    # Key -> (value, size), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for a key and marks it as most recently used.
+
+        Parameters:
+        - key: The key to look up.
+        - default: The value returned if the key is not cached.
 
         Returns:
-        - bytes: The 'Last-Modified' header value or the current time.
+        - The cached value or default.
+        """
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return default
+            self.entries.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size: int):
+        """
+        Stores a value, evicting the least recently used entries until the cache is within its bounds.
+
+        Parameters:
+        - key: The key to store the value under.
+        - value: The value to store.
+        - size (int): The size of the value in bytes.
+        """
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+            # Never cache a value larger than the whole cache
+            if size > self.max_bytes:
+                return
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+
+class SpliceChannel:
+    def __init__(self, src: socket.socket, dst: socket.socket, size: int):
+        """
+        Moves data in one direction of a tunnel through a kernel pipe using splice().
+
+        Parameters:
+        - src (socket.socket): The socket data is read from.
+        - dst (socket.socket): The socket data is written to.
+        - size (int): The maximum number of bytes moved by a single splice() call.
+        """
+        self.src_fd = src.fileno()
+        self.dst_fd = dst.fileno()
+        self.size = size
+        self.flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        self.pending = 0    # Bytes in the pipe not yet written to dst
+        self.pipe_r, self.pipe_w = os.pipe()
+
+        try:
+            fcntl.fcntl(self.pipe_w, fcntl.F_SETPIPE_SZ, size)
+        except OSError:
+            pass    # Keep the default pipe size if the limit is lower
+
+    def fill(self) -> bool:
+        """
+        Moves available data from the source socket into the pipe.
+
+        Returns:
+        - bool: False if the source socket has been closed.
+        """
+        try:
+            n = os.splice(self.src_fd, self.pipe_w, self.size, flags=self.flags)
+        except BlockingIOError:
+            return True
+        self.pending += n
+        return n > 0
+
+    def flush(self):
+        """
+        Moves as much pending data as possible from the pipe into the destination socket.
+        """
+        splice = os.splice
+        pipe_r, dst_fd, flags = self.pipe_r, self.dst_fd, self.flags
+        pending = self.pending
+        try:
+            while pending:
+                pending -= splice(pipe_r, dst_fd, pending, flags=flags)
+        except BlockingIOError:
+            pass
+        finally:
+            self.pending = pending
+
+    def close(self):
+        """
+        Closes the pipe.
+        """
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+
+
+class CopyChannel:
+    def __init__(self, src: socket.socket, dst: socket.socket, size: int):
+        """
+        Moves data in one direction of a tunnel by copying it through user space.
+
+        Parameters:
+        - src (socket.socket): The socket data is read from.
+        - dst (socket.socket): The socket data is written to.
+        - size (int): The size of the receive buffer.
+        """
+        self.src = src
+        self.dst = dst
+        self.pending = 0    # Bytes received but not yet written to dst
+        self.length = 0     # Bytes received by the last fill()
+        self.buffer = memoryview(bytearray(size))
+
+    def fill(self) -> bool:
+        """
+        Receives available data from the source socket into the buffer.
+
+        Returns:
+        - bool: False if the source socket has been closed.
+        """
+        try:
+            n = self.src.recv_into(self.buffer)
+        except BlockingIOError:
+            return True
+        self.length = self.pending = n
+        return n > 0
+
+    def flush(self):
+        """
+        Sends as much pending data as possible to the destination socket.
+        """
+        send = self.dst.send
+        buffer, length = self.buffer, self.length
+        pending = self.pending
+        try:
+            while pending:
+                pending -= send(buffer[length - pending:length])
+        except BlockingIOError:
+            pass
+        finally:
+            self.pending = pending
+
+    def close(self):
+        """
+        Releases the buffer.
+        """
+        self.buffer.release()
+
+
+class Tunnel:
+    def __init__(self, selector: selectors.BaseSelector, client_socket: socket.socket, server_socket: socket.socket, make_channel, on_close):
+        """
+        An established HTTPS tunnel, relayed without blocking by the proxy's selector loop.
+
+        Parameters:
+        - selector (selectors.BaseSelector): The selector the tunnel registers its sockets with.
+        - client_socket (socket.socket): The socket to communicate with the client.
+        - server_socket (socket.socket): The socket to communicate with the target server.
+        - make_channel (function): Creates the channel moving data from one socket to the other.
+        - on_close (function): Called once the tunnel has been closed.
+        """
+        self.selector = selector
+        self.on_close = on_close
+        self.closed = False
+
+        upstream = make_channel(client_socket, server_socket)
+        try:
+            downstream = make_channel(server_socket, client_socket)
+        except Exception:
+            # e.g. no file descriptors left for the second pipe
+            upstream.close()
+            raise
+        self.outgoing = {client_socket: upstream, server_socket: downstream}
+        self.incoming = {client_socket: downstream, server_socket: upstream}
+        self.events = {client_socket: 0, server_socket: 0}  # Events each socket is registered for
+
+    def start(self):
+        """
+        Registers both sockets with the selector. Must be called from the selector loop.
+        """
+        for sock in self.events:
+            sock.setblocking(False)
+            self._update(sock)
+
+    def relay(self, sock: socket.socket, mask: int):
+        """
+        Selector callback which moves data through the tunnel when one of its sockets is ready.
+
+        Parameters:
+        - sock (socket.socket): The ready socket.
+        - mask (int): The selector events that are ready.
+        """
+        if self.closed:
+            return
+
+        try:
+            if mask & selectors.EVENT_READ:
+                channel = self.outgoing[sock]
+                if not channel.fill():
+                    self.close()
+                    return
+                channel.flush()
+
+            if mask & selectors.EVENT_WRITE:
+                self.incoming[sock].flush()
+        except OSError:
+            self.close()
+            return
+
+        for s in self.events:
+            self._update(s)
+
+    def _update(self, sock: socket.socket):
+        """
+        Only reads from a socket once its previous data has been delivered, and waits for it to be writable
+        while data destined for it is pending.
+
+        Parameters:
+        - sock (socket.socket): The socket to update the selector registration for.
+        """
+        events = 0
+        if not self.outgoing[sock].pending:
+            events |= selectors.EVENT_READ
+        if self.incoming[sock].pending:
+            events |= selectors.EVENT_WRITE
+
+        current = self.events[sock]
+        if events == current:
+            return
+
+        if not current:
+            self.selector.register(sock, events, self.relay)
+        elif not events:
+            self.selector.unregister(sock)
+        else:
+            self.selector.modify(sock, events, self.relay)
+        self.events[sock] = events
+
+    def close(self):
+        """
+        Closes both sockets and channels of the tunnel.
         """
-        lines = request.split(b'\r\n')
-        for line in lines:
-            if line.lower().startswith(b'last-modified:'):
-                return line.split(b':', 1)[1].strip()
-        return time.strftime(b'%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+        self.closed = True
+        for sock, events in self.events.items():
+            if events:
+                self.selector.unregister(sock)
+            sock.close()
+
+        for channel in self.outgoing.values():
+            channel.close()
+        self.on_close()
 
 
 class ManagementConsole(tk.Tk):
+    # Constants
+    LOG_INTERVAL = 50   # Milliseconds between log updates
+    LOG_BATCH = 200     # Maximum number of messages added per log update
+    LOG_LINES = 1000    # Maximum number of lines kept in the log
+
     def __init__(self):
         """
         Initializes the management console GUI for controlling the proxy server.
@@ -353,6 +1365,10 @@ class ManagementConsole(tk.Tk):
 
         self.proxy_server = None
 
+        # Messages are queued by any thread and added to the log by the Tk main loop
+        self._log_q = queue.SimpleQueue()
+        self.after(self.LOG_INTERVAL, self._drain_logs)
+
     def start_server(self):
         """
         Starts the proxy server in a separate thread when the start button is clicked.
@@ -364,23 +1380,40 @@ class ManagementConsole(tk.Tk):
 
     def update_log(self, message):
         """
-        Updates the console log with a new message.
+        Queues a new message for the console log. Safe to call from any thread.
         
         Parameters:
         - message (str): The log message to display.
         """
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, message + '\n')
-        self.log_text.config(state=tk.DISABLED)
-        self.log_text.yview(tk.END)
+        self._log_q.put(message)
+
+    def _drain_logs(self):
+        """
+        Adds the queued messages to the console log in a single update, dropping the oldest lines
+        once the log is full, then schedules the next update.
+        """
+        messages = []
+        while len(messages) < self.LOG_BATCH:
+            try:
+                messages.append(self._log_q.get_nowait())
+            except queue.Empty:
+                break
+
+        if messages:
+            self.log_text.config(state=tk.NORMAL)
+            self.log_text.insert(tk.END, '\n'.join(messages) + '\n')
+            self.log_text.delete('1.0', f'{tk.END}-{self.LOG_LINES}l')
+            self.log_text.config(state=tk.DISABLED)
+            self.log_text.yview(tk.END)
+
+        self.after(self.LOG_INTERVAL, self._drain_logs)
 
     def add_blocked_url(self):
         """
         Adds a URL to the blocked list if it is not already blocked.
         """
         url = self.word_entry.get().strip()
-        if url and url not in self.proxy_server.blocked_urls:
-            self.proxy_server.blocked_urls.add(url)
+        if url and self.proxy_server.add_blocked_url(url):
             self.blocked_listbox.insert(tk.END, url)
             self.update_log(f'Added blocked URL: {url}')
         else:
@@ -393,7 +1426,7 @@ class ManagementConsole(tk.Tk):
         """
         selected_url = self.blocked_listbox.get(tk.ACTIVE)
         if selected_url:
-            self.proxy_server.blocked_urls.remove(selected_url)
+            self.proxy_server.remove_blocked_url(selected_url)
             self.blocked_listbox.delete(tk.ACTIVE)
             self.update_log(f'Removed blocked URL: {selected_url}')
         else:
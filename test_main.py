@@ -0,0 +1,336 @@
+import selectors
+import socket
+import threading
+import time
+import unittest
+
+from main import CopyChannel, LRUCache, Tunnel, WebProxyServer
+
+
+def make_proxy(test: unittest.TestCase) -> WebProxyServer:
+    """
+    Creates a proxy that is not listening, and releases its resources when the test finishes.
+
+    Parameters:
+    - test (unittest.TestCase): The test using the proxy.
+
+    Returns:
+    - WebProxyServer: The proxy.
+    """
+    proxy = WebProxyServer()
+    test.addCleanup(proxy._workers.shutdown)
+    test.addCleanup(proxy.selector.close)
+    test.addCleanup(proxy._wakeup_r.close)
+    test.addCleanup(proxy._wakeup_w.close)
+    return proxy
+
+
+class RecvAllTest(unittest.TestCase):
+    def setUp(self):
+        self.proxy = make_proxy(self)
+        self.server, self.client = socket.socketpair()
+        self.client.settimeout(5)
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def recv(self, response: bytes, close=False, no_body=False) -> tuple:
+        """
+        Sends a response from the server end of the pair and reads it back with recv_all.
+
+        Parameters:
+        - response (bytes): The raw response the server sends.
+        - close (bool): If true, the server closes the connection after sending.
+        - no_body (bool): Passed on to recv_all.
+
+        Returns:
+        - bytes: The response read by recv_all.
+        - bool: Whether recv_all considers the connection reusable.
+        """
+        self.server.sendall(response)
+        if close:
+            self.server.close()
+        return self.proxy.recv_all(self.client, no_body)
+
+    def test_content_length(self):
+        response = b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello'
+        self.assertEqual(self.recv(response), (response, True))
+
+    def test_content_length_truncated(self):
+        response = b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nhello'
+        self.assertEqual(self.recv(response, close=True), (response, False))
+
+    def test_chunked(self):
+        response = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\n\r\n'
+        self.assertEqual(self.recv(response), (response, True))
+
+    def test_chunked_trailers(self):
+        response = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                    b'5\r\nhello\r\n0\r\nExpires: 0\r\nX-Checksum: 1\r\n\r\n')
+        self.assertEqual(self.recv(response), (response, True))
+
+    def test_chunked_malformed_size(self):
+        response = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\nhello\r\n0\r\n\r\n'
+        with self.assertRaises(ValueError):
+            self.recv(response)
+
+    def test_interim_response(self):
+        final = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+        self.assertEqual(self.recv(b'HTTP/1.1 100 Continue\r\n\r\n' + final), (final, True))
+
+    def test_no_content(self):
+        response = b'HTTP/1.1 204 No Content\r\n\r\n'
+        self.assertEqual(self.recv(response), (response, True))
+
+    def test_not_modified_ignores_content_length(self):
+        response = b'HTTP/1.1 304 Not Modified\r\nContent-Length: 100\r\n\r\n'
+        self.assertEqual(self.recv(response), (response, True))
+
+    def test_head(self):
+        response = b'HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n'
+        self.assertEqual(self.recv(response, no_body=True), (response, True))
+
+    def test_read_until_close(self):
+        response = b'HTTP/1.0 200 OK\r\n\r\nhello'
+        self.assertEqual(self.recv(response, close=True), (response, False))
+
+    def test_connection_close(self):
+        response = b'HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 5\r\n\r\nhello'
+        self.assertEqual(self.recv(response), (response, False))
+
+
+class RequestEndTest(unittest.TestCase):
+    def setUp(self):
+        self.proxy = make_proxy(self)
+
+    def test_incomplete_headers(self):
+        self.assertEqual(self.proxy._request_end(bytearray(b'GET / HTTP/1.1\r\nHost: a\r\n')), (-1, 0))
+
+    def test_no_body(self):
+        request = bytearray(b'GET / HTTP/1.1\r\nHost: a\r\n\r\n')
+        self.assertEqual(self.proxy._request_end(request), (len(request), 0))
+
+    def test_content_length(self):
+        request = bytearray(b'POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\nhel')
+        self.assertEqual(self.proxy._request_end(request)[0], -1)
+        request += b'lo'
+        self.assertEqual(self.proxy._request_end(request)[0], len(request))
+
+    def test_chunked(self):
+        request = bytearray(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n')
+        end, resume = self.proxy._request_end(request)
+        self.assertEqual(end, -1)
+
+        # Feed the body a few bytes at a time, resuming from the last complete chunk
+        body = b'5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nExpires: 0\r\n\r\n'
+        for i in range(0, len(body), 4):
+            self.assertEqual(end, -1)
+            request += body[i:i + 4]
+            end, resume = self.proxy._request_end(request, resume)
+        self.assertEqual(end, len(request))
+
+    def test_chunked_ignores_content_length(self):
+        request = bytearray(b'POST / HTTP/1.1\r\nContent-Length: 2\r\nTransfer-Encoding: chunked\r\n\r\nab')
+        self.assertEqual(self.proxy._request_end(request)[0], -1)
+
+    def test_chunked_malformed_size(self):
+        for size in (b'zz', b'-5'):
+            with self.assertRaises(ValueError):
+                self.proxy._request_end(bytearray(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n' + size + b'\r\n'))
+
+
+class MakePersistentTest(unittest.TestCase):
+    def test_replaces_connection_headers(self):
+        proxy = make_proxy(self)
+        request = (b'GET http://a/ HTTP/1.0\r\nHost: a\r\nProxy-Connection: close\r\n'
+                   b'connection: close\r\nKeep-Alive: 5\r\n\r\nbody')
+        self.assertEqual(proxy.make_persistent(request),
+                         b'GET http://a/ HTTP/1.0\r\nConnection: keep-alive\r\nHost: a\r\n\r\nbody')
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2, 100)
+        cache.put('a', 1, 1)
+        cache.put('b', 2, 1)
+        cache.get('a')
+        cache.put('c', 3, 1)
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertIsNone(cache.get('b'))
+
+    def test_evicts_to_fit_size(self):
+        cache = LRUCache(10, 10)
+        for key in 'abc':
+            cache.put(key, key, 4)
+        self.assertEqual(list(cache.entries), ['b', 'c'])
+        self.assertEqual(cache.size, 8)
+
+    def test_replace_updates_size(self):
+        cache = LRUCache(10, 10)
+        cache.put('a', 1, 4)
+        cache.put('a', 2, 6)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(cache.size, 6)
+
+    def test_oversized_value_drops_old_entry(self):
+        cache = LRUCache(10, 10)
+        cache.put('a', 1, 4)
+        cache.put('a', 2, 11)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+
+class FetchTest(unittest.TestCase):
+    URL = 'http://a/'
+    REQUEST = b'GET http://a/ HTTP/1.1\r\nHost: a\r\n\r\n'
+    RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+
+    def setUp(self):
+        self.proxy = make_proxy(self)
+        self.calls = 0
+        self.release = threading.Event()
+        self.proxy.forward_to_server = self.forward
+
+    def forward(self, request: bytes, target_host: str) -> bytes:
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait(5)
+            if self.fail_first:
+                raise OSError('unreachable')
+        return self.RESPONSE
+
+    def fetch_concurrently(self) -> list:
+        """
+        Starts a fetch, then a second one for the same URL while the first is still waiting on the target server.
+
+        Returns:
+        - list: The responses returned, or exceptions raised, by both fetches.
+        """
+        results = [None, None]
+
+        def run(i):
+            try:
+                results[i] = self.proxy.fetch(self.URL, self.REQUEST, 'a', time.time())
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(2)]
+        threads[0].start()
+        while self.URL not in self.proxy._pending:
+            time.sleep(0.01)
+        threads[1].start()
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_shares_response(self):
+        self.fail_first = False
+        self.assertEqual(self.fetch_concurrently(), [self.RESPONSE, self.RESPONSE])
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.proxy.cache.get(self.URL).body, self.RESPONSE)
+        self.assertEqual(self.proxy._pending, {})
+
+    def test_waiter_fetches_itself_after_failure(self):
+        self.fail_first = True
+        first, second = self.fetch_concurrently()
+        self.assertIsInstance(first, OSError)
+        self.assertEqual(second, self.RESPONSE)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.proxy._pending, {})
+
+
+class MakeConditionalTest(unittest.TestCase):
+    def test_replaces_client_conditions(self):
+        proxy = make_proxy(self)
+        request = (b'GET http://a/ HTTP/1.1\r\nHost: a\r\nif-none-match: "x"\r\n'
+                   b'If-Modified-Since: Mon, 01 Jan 2024 00:00:00 GMT\r\n\r\n')
+        self.assertEqual(proxy.make_conditional(request, b'Tue, 02 Jan 2024 00:00:00 GMT'),
+                         b'GET http://a/ HTTP/1.1\r\nIf-Modified-Since: Tue, 02 Jan 2024 00:00:00 GMT\r\n'
+                         b'Host: a\r\n\r\n')
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.proxy = make_proxy(self)
+
+    def make_socket(self) -> socket.socket:
+        """
+        Creates a connected socket that is closed when the test finishes.
+
+        Returns:
+        - socket.socket: One end of a socket pair.
+        """
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        return a
+
+    def test_reuses_most_recent_connection(self):
+        older, newer = self.make_socket(), self.make_socket()
+        self.proxy.release('a', 80, older)
+        self.proxy.release('a', 80, newer)
+        self.assertEqual(self.proxy.connect('a', 80), (newer, True))
+        self.assertEqual(self.proxy._pool_idle, 1)
+
+    def test_expires_idle_connections(self):
+        sock = self.make_socket()
+        self.proxy.release('a', 80, sock)
+        with self.proxy._pool_lock:
+            self.proxy._expire_idle(time.monotonic() + self.proxy.POOL_IDLE_TIMEOUT + 1)
+        self.assertEqual(sock.fileno(), -1)
+        self.assertEqual(self.proxy._pool, {})
+        self.assertEqual(self.proxy._pool_idle, 0)
+
+    def test_caps_idle_connections(self):
+        self.proxy.POOL_SIZE = 2
+        self.proxy.POOL_TOTAL = 3
+        socks = [self.make_socket() for _ in range(5)]
+        for sock in socks[:3]:
+            self.proxy.release('a', 80, sock)
+        for sock in socks[3:]:
+            self.proxy.release('b', 80, sock)
+
+        # 'a' is capped per server, then 'b' by the total
+        self.assertEqual([sock.fileno() == -1 for sock in socks], [False, False, True, False, True])
+        self.assertEqual(self.proxy._pool_idle, 3)
+
+
+class ForwardToServerTest(unittest.TestCase):
+    def test_closes_socket_on_malformed_response(self):
+        proxy = make_proxy(self)
+        server, client = socket.socketpair()
+        server.sendall(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n')
+        proxy.connect = lambda host, port: (client, False)
+        try:
+            with self.assertRaises(ValueError):
+                proxy.forward_to_server(b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n', 'example.com')
+            self.assertEqual(client.fileno(), -1)
+        finally:
+            server.close()
+            client.close()
+
+
+class TunnelTest(unittest.TestCase):
+    def test_closes_first_channel_when_second_fails(self):
+        channels = []
+
+        def make_channel(src, dst):
+            if channels:
+                raise OSError('too many open files')
+            channels.append(CopyChannel(src, dst, 16))
+            return channels[-1]
+
+        client, server = socket.socketpair()
+        self.addCleanup(client.close)
+        self.addCleanup(server.close)
+        with selectors.DefaultSelector() as selector, self.assertRaises(OSError):
+            Tunnel(selector, client, server, make_channel, lambda: None)
+        with self.assertRaises(ValueError):
+            channels[0].buffer.tobytes()   # Released by close()
+
+
+if __name__ == '__main__':
+    unittest.main()